@@ -1,18 +1,46 @@
 from collections import defaultdict, deque
 import json
-import time
+import sys
+import threading
 import paho.mqtt.client as mqtt
 from db import get_connection, DB_PATH
+from checkpoint import CheckpointError, load_checkpoint, save_checkpoint
+from history import METRICS, StoredReadingsMixin
+from sampling import AdaptivePersistence
+from timeutil import parse_ts_ms
 
 
-class AnomalyDetector:
+class AnomalyDetector(StoredReadingsMixin):
 
     WINDOW_SIZE = 60   # readings per device per metric
     Z_THRESHOLD = 3.0
+    MIN_WINDOW = 20    # readings required before a metric is scored
 
-    def __init__(self, broker_host="localhost", broker_port=1883):
+    def __init__(self, broker_host="localhost", broker_port=1883,
+                 checkpoint_path=None, checkpoint_interval=30.0, block_store=None,
+                 persistence=None, profiles=None):
+        """
+        Args:
+            broker_host: MQTT broker hostname
+            broker_port: MQTT broker port
+            checkpoint_path: File to snapshot detector state to. None disables
+                checkpointing; windows are then rebuilt from sensor_readings.
+            checkpoint_interval: Seconds between background snapshots.
+            block_store: Optional BlockStore. When set, every reading is kept
+                in compressed blocks instead of sampled into sensor_readings.
+            persistence: Policy choosing which readings go to sensor_readings
+                (see sampling.py). Defaults to AdaptivePersistence().
+            profiles: Optional BaselineProfiles. When set, readings are scored
+                against time-of-day baselines instead of the sliding window
+                wherever the profile has enough history.
+        """
         self.broker_host = broker_host
         self.broker_port = broker_port
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.block_store = block_store
+        self.persistence = persistence if persistence is not None else AdaptivePersistence()
+        self.profiles = profiles
         self.client = mqtt.Client(client_id="aegisflow-detector")
 
         self.windows = defaultdict(lambda: defaultdict(lambda: deque(maxlen=self.WINDOW_SIZE)))
@@ -25,7 +53,34 @@ class AnomalyDetector:
 
         self._read_counter = defaultdict(int)
 
+        # Guards the in-memory state against the checkpoint thread.
+        self._lock = threading.Lock()
+        self._version = 0
+        self._checkpointed_version = 0
+        self._stop_event = threading.Event()
+        self._checkpoint_thread = None
+        # Serializes start() against stop(), which may run on another thread
+        # while start() is still waiting for the broker.
+        self._lifecycle_lock = threading.Lock()
+        self._connected = False
+
     def start(self, retries: int = 10, delay: float = 3.0):
+        """
+        Restore state, start background threads and connect to the broker.
+        Returns early without starting anything further once stop() has been called.
+        """
+        self.restore()
+        with self._lifecycle_lock:
+            if self._stop_event.is_set():
+                return
+            if self.profiles is not None:
+                self.profiles.start()
+            if self.block_store is not None:
+                self.block_store.start()
+            if self.checkpoint_path:
+                self._checkpoint_thread = threading.Thread(target=self._checkpoint_loop, daemon=True)
+                self._checkpoint_thread.start()
+
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         for attempt in range(1, retries + 1):
@@ -35,13 +90,192 @@ class AnomalyDetector:
             except ConnectionRefusedError:
                 if attempt == retries:
                     raise
-                print(f"⏳ Detector: MQTT broker not ready, retrying in {delay}s ({attempt}/{retries})...")
-                time.sleep(delay)
-        self.client.loop_start()
+                print(f"⏳ Detector: MQTT broker not ready, retrying in {delay}s ({attempt}/{retries})...",
+                      file=sys.stderr)
+                if self._stop_event.wait(delay):
+                    return
+
+        with self._lifecycle_lock:
+            if self._stop_event.is_set():
+                self.client.disconnect()
+                return
+            self.client.loop_start()
+            self._connected = True
 
     def stop(self):
-        self.client.loop_stop()
-        self.client.disconnect()
+        """Stop all background threads. Safe to call before, during or after start()."""
+        with self._lifecycle_lock:
+            self._stop_event.set()
+            connected, self._connected = self._connected, False
+        if connected:
+            self.client.loop_stop()
+            self.client.disconnect()
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join(timeout=5)
+        if self.profiles is not None:
+            self.profiles.stop()
+        if self.block_store is not None:
+            self.block_store.stop()
+        self.checkpoint()
+
+    def snapshot(self) -> dict:
+        """Copy of the state needed for a warm restart; cheap enough to take under the lock."""
+        with self._lock:
+            return {
+                "version":          self._version,
+                "metrics":          list(METRICS),
+                "windows":          {
+                    device_id: {metric: list(window) for metric, window in metrics.items()}
+                    for device_id, metrics in self.windows.items()
+                },
+                "read_counters":    dict(self._read_counter),
+                "active_anomalies": dict(self.active_anomalies),
+                "latest_readings":  dict(self.latest_readings),
+            }
+
+    def checkpoint(self):
+        """Write a snapshot to checkpoint_path if anything changed since the last one."""
+        if not self.checkpoint_path or self._version == self._checkpointed_version:
+            return
+        state = self.snapshot()
+        try:
+            save_checkpoint(self.checkpoint_path, state)
+            self._checkpointed_version = state["version"]
+        except OSError as e:
+            print(f"Checkpoint write failed: {e}", file=sys.stderr)
+
+    @property
+    def version(self) -> int:
+        """Incremented on every processed reading or cleared anomaly."""
+        return self._version
+
+    def rolling_stats(self) -> dict:
+        """Current window mean, std and sample count per device and metric."""
+        with self._lock:
+            return self._rolling_stats()
+
+    def live_state(self) -> dict:
+        """The state other processes need to answer tools, as plain JSON-able data."""
+        with self._lock:
+            return {
+                "version":          self._version,
+                "latest_readings":  dict(self.latest_readings),
+                "active_anomalies": dict(self.active_anomalies),
+                "rolling_stats":    self._rolling_stats(),
+            }
+
+    def reconcile(self):
+        """Drop active anomalies that were resolved in the DB by another process."""
+        with self._lock:
+            before = set(self.active_anomalies)
+            self._reconcile_active_anomalies()
+            if set(self.active_anomalies) != before:
+                self._version += 1
+
+    def _rolling_stats(self):
+        stats = {}
+        for device_id, metrics in self.windows.items():
+            stats[device_id] = {}
+            for metric, window in metrics.items():
+                n = len(window)
+                if not n:
+                    continue
+                mean = sum(window) / n
+                std = (sum((x - mean) ** 2 for x in window) / n) ** 0.5
+                stats[device_id][metric] = {"mean": round(mean, 4), "std": round(std, 4), "n": n}
+        return stats
+
+    def restore(self):
+        """
+        Restore windows, counters and anomalies from the last checkpoint, or
+        rebuild the windows from sensor_readings when there is none. Active
+        anomalies are then reconciled with the rows still pending in the DB.
+        """
+        state = None
+        if self.checkpoint_path:
+            try:
+                state = load_checkpoint(self.checkpoint_path)
+            except CheckpointError as e:
+                print(f"No usable checkpoint ({e}); rebuilding windows from the database",
+                      file=sys.stderr)
+
+        with self._lock:
+            if state is not None:
+                for device_id, metrics in state["windows"].items():
+                    for metric, values in metrics.items():
+                        self.windows[device_id][metric].extend(values)
+                self._read_counter.update(state["read_counters"])
+                self.latest_readings.update(state["latest_readings"])
+                self.active_anomalies.update(state["active_anomalies"])
+            else:
+                self._rebuild_windows_from_db()
+            self._reconcile_active_anomalies()
+
+    def _rebuild_windows_from_db(self):
+        if self.block_store is not None:
+            recent = self.block_store.read_recent(self.block_store.devices(), self.WINDOW_SIZE)
+            for device_id, rows in recent.items():
+                for row in reversed(rows):
+                    for metric in METRICS:
+                        if row[metric] is not None:
+                            self.windows[device_id][metric].append(row[metric])
+            return
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT device_id, {", ".join(METRICS)}
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY device_id ORDER BY timestamp DESC
+                ) AS rn
+                FROM sensor_readings
+            )
+            WHERE rn <= ?
+            ORDER BY device_id, timestamp
+        """, (self.WINDOW_SIZE,))
+        for device_id, *values in cursor.fetchall():
+            for metric, value in zip(METRICS, values):
+                if value is not None:
+                    self.windows[device_id][metric].append(value)
+        conn.close()
+
+    def _reconcile_active_anomalies(self):
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT detected_at, device_id, severity, description, sensor_values
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY device_id ORDER BY detected_at DESC
+                ) AS rn
+                FROM anomalies
+                WHERE action_status = 'pending'
+            )
+            WHERE rn = 1
+        """)
+        pending = {}
+        for detected_at, device_id, severity, description, sensor_values in cursor.fetchall():
+            pending[device_id] = {
+                "detected_at":       detected_at,
+                "device_id":         device_id,
+                "severity":          severity,
+                "anomalous_metrics": json.loads(description) if description else [],
+                "sensor_values":     json.loads(sensor_values) if sensor_values else {},
+            }
+        conn.close()
+
+        # Anything resolved while we were down is dropped; anything the DB
+        # still lists as pending is re-armed so it is not re-detected.
+        for device_id in list(self.active_anomalies):
+            if device_id not in pending:
+                del self.active_anomalies[device_id]
+        for device_id, info in pending.items():
+            self.active_anomalies.setdefault(device_id, info)
+
+    def _checkpoint_loop(self):
+        while not self._stop_event.wait(self.checkpoint_interval):
+            self.checkpoint()
 
     def _on_connect(self, client, userdata, flags, rc):
         client.subscribe("aegisflow/sensors/#")
@@ -49,27 +283,44 @@ class AnomalyDetector:
     def _on_message(self, client, userdata, msg):
         try:
             data = json.loads(msg.payload.decode())
+        except Exception as e:
+            print(f"Error processing message: {e}", file=sys.stderr)
+            return
+        with self._lock:
+            effects = self._process(data)
+        # Database writes and the callback run without the lock, so snapshots
+        # never wait on SQLite and the callback may call back into the detector.
+        if effects is not None:
+            self._persist(*effects)
+
+    def _process(self, data):
+        """
+        Score one reading and update the in-memory state; call with the lock held.
+        Returns (readings to persist, new anomaly or None), or None on bad input.
+        """
+        try:
             device_id = data["device_id"]
+            self._version += 1
 
             self.latest_readings[device_id] = data
 
             self._read_counter[device_id] += 1
-            if self._read_counter[device_id] % 5 == 0:
-                self._store_reading(data)
 
-            metrics = ["temperature", "pressure", "vibration", "humidity", "power_consumption"]
             anomalous_metrics = []
+            stds = {}
+            ts_ms = parse_ts_ms(data["timestamp"]) if self.profiles is not None else None
 
-            for metric in metrics:
+            for metric in METRICS:
                 value = data.get(metric)
                 if value is None:
                     continue
 
                 window = self.windows[device_id][metric]
+                baseline = self._baseline(device_id, metric, window, ts_ms)
 
-                if len(window) >= 20:
-                    mean = sum(window) / len(window)
-                    std = (sum((x - mean) ** 2 for x in window) / len(window)) ** 0.5
+                if baseline is not None:
+                    mean, std = baseline
+                    stds[metric] = std
 
                     if std > 0:
                         z_score = abs(value - mean) / std
@@ -84,7 +335,21 @@ class AnomalyDetector:
 
                 window.append(value)
 
-            if anomalous_metrics and device_id not in self.active_anomalies:
+            entering_anomaly = bool(anomalous_metrics) and device_id not in self.active_anomalies
+            # Full-rate capture starts on a new alert, or on a critical breach
+            # while an earlier alert is still open.
+            capture = entering_anomaly or (
+                bool(anomalous_metrics)
+                and self._classify_severity(anomalous_metrics) == "critical"
+            )
+
+            if self.block_store is not None:
+                to_store = [data]
+            else:
+                to_store = self.persistence.observe(data, stds, capture)
+
+            anomaly_info = None
+            if entering_anomaly:
                 severity = self._classify_severity(anomalous_metrics)
                 anomaly_info = {
                     "detected_at":      data["timestamp"],
@@ -94,13 +359,39 @@ class AnomalyDetector:
                     "sensor_values":    data,
                 }
                 self.active_anomalies[device_id] = anomaly_info
-                self._store_anomaly(anomaly_info)
 
+            return to_store, anomaly_info
+
+        except Exception as e:
+            print(f"Error processing message: {e}", file=sys.stderr)
+            return None
+
+    def _persist(self, readings, anomaly_info):
+        try:
+            if readings and self.block_store is not None:
+                for reading in readings:
+                    self.block_store.append(reading)
+            elif readings:
+                self._store_readings(readings)
+            if anomaly_info is not None:
+                self._store_anomaly(anomaly_info)
                 if self.on_anomaly_detected:
                     self.on_anomaly_detected(anomaly_info)
-
         except Exception as e:
-            print(f"Error processing message: {e}")
+            print(f"Error storing reading: {e}", file=sys.stderr)
+
+    def _baseline(self, device_id, metric, window, ts_ms):
+        """(mean, std) to score against: the time-of-day profile if one is
+        loaded for this bucket, otherwise the sliding window once it is full enough."""
+        if self.profiles is not None:
+            profile = self.profiles.lookup(device_id, metric, ts_ms)
+            if profile is not None:
+                return profile
+        if len(window) >= self.MIN_WINDOW:
+            mean = sum(window) / len(window)
+            std = (sum((x - mean) ** 2 for x in window) / len(window)) ** 0.5
+            return mean, std
+        return None
 
     def _classify_severity(self, anomalous_metrics):
         max_z = max(m["z_score"] for m in anomalous_metrics)
@@ -115,18 +406,18 @@ class AnomalyDetector:
         else:
             return "low"
 
-    def _store_reading(self, data):
+    def _store_readings(self, readings):
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.executemany("""
             INSERT INTO sensor_readings
                 (timestamp, device_id, temperature, pressure, vibration, humidity, power_consumption)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
+        """, [(
             data["timestamp"], data["device_id"],
             data["temperature"], data["pressure"], data["vibration"],
             data["humidity"], data["power_consumption"],
-        ))
+        ) for data in readings])
         conn.commit()
         conn.close()
 
@@ -146,20 +437,6 @@ class AnomalyDetector:
 
     def clear_anomaly(self, device_id):
         """Clear active anomaly for a device after resolution."""
-        self.active_anomalies.pop(device_id, None)
-
-    def get_recent_readings(self, device_id, limit=50):
-        """Fetch recent stored readings for a device from SQLite."""
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT timestamp, temperature, pressure, vibration, humidity, power_consumption
-            FROM sensor_readings
-            WHERE device_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        """, (device_id, limit))
-        columns = [desc[0] for desc in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        conn.close()
-        return results
+        with self._lock:
+            if self.active_anomalies.pop(device_id, None) is not None:
+                self._version += 1
@@ -0,0 +1,292 @@
+"""
+Per-device, per-metric, time-of-day baseline profiles.
+
+The day is split into fixed buckets (15 minutes by default). For every
+device, metric and bucket the profile stores the count, mean and sum of
+squared deviations (M2) of the stored readings that fell into that bucket.
+Readings are left out when they were taken while the device had a detected
+anomaly, or when any metric lies further than `clip_sigma` robust standard
+deviations (scaled MAD) from the device's median over the trailing day, so
+an incident does not teach the profile that its own readings are normal
+even when its alert was never recorded. One bucket on either side of such
+a reading is left out too, which covers the onset of a ramp before it
+crosses the limit.
+
+refresh_profiles() folds in only readings newer than each device's
+watermark, merging with the stored aggregates, so it can run as often as
+new data lands; the newest bucket's worth of readings is held back until
+the next refresh so that an outlier just after them can still exclude
+them. AnomalyDetector in 'profile' mode scores readings against these
+tables with one list lookup per metric.
+
+Run directly to refresh from stored history, or with --full to rebuild
+from scratch (required after changing the bucket size):
+
+    python baselines.py [--full]
+"""
+import sys
+import threading
+
+import numpy as np
+
+from db import get_connection
+from history import METRICS, StoredReadingsMixin
+from timeutil import format_ts_ms, parse_ts_ms
+
+DAY_SECONDS = 86400
+
+
+class _History(StoredReadingsMixin):
+    def __init__(self, block_store=None):
+        self.block_store = block_store
+
+
+def _bucket_index(ts_ms, bucket_seconds):
+    return (ts_ms // 1000 % DAY_SECONDS) // bucket_seconds
+
+
+def _stored_devices(block_store):
+    if block_store is not None:
+        return block_store.devices()
+    conn = get_connection()
+    rows = conn.execute("SELECT DISTINCT device_id FROM sensor_readings").fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+def _anomaly_intervals(max_exclusion_ms, guard_ms):
+    """
+    device_id -> [(start_ms, end_ms)] spans to leave out of the profiles: from
+    `guard_ms` before each anomaly was detected until it was resolved, but never
+    more than `max_exclusion_ms` past detection (resolved_at is wall-clock time
+    and unresolved anomalies have none).
+    """
+    conn = get_connection()
+    rows = conn.execute("SELECT device_id, detected_at, resolved_at FROM anomalies").fetchall()
+    conn.close()
+    intervals = {}
+    for device_id, detected_at, resolved_at in rows:
+        detected = parse_ts_ms(detected_at)
+        end = detected + max_exclusion_ms
+        if resolved_at:
+            end = max(min(end, parse_ts_ms(resolved_at)), detected)
+        intervals.setdefault(device_id, []).append((detected - guard_ms, end))
+    return intervals
+
+
+def _robust_limits(values, clip_sigma):
+    """(low, high) bounds at clip_sigma scaled MADs around the median of values."""
+    x = values[~np.isnan(values)]
+    if clip_sigma <= 0 or not len(x):
+        return -np.inf, np.inf
+    median = np.median(x)
+    sigma = 1.4826 * np.median(np.abs(x - median))
+    if sigma == 0:
+        return -np.inf, np.inf
+    return median - clip_sigma * sigma, median + clip_sigma * sigma
+
+
+def refresh_profiles(block_store=None, bucket_seconds: int = 900, full: bool = False,
+                     max_exclusion_seconds: float = 7200.0, clip_sigma: float = 4.0) -> int:
+    """
+    Fold readings stored since the last refresh into baseline_profiles,
+    skipping readings that fall inside an anomaly interval and outlying
+    values (see module docstring).
+    With full=True the profiles are rebuilt from all stored history.
+    Returns the number of readings folded in.
+    """
+    n_buckets = DAY_SECONDS // bucket_seconds
+    guard_ms = bucket_seconds * 1000
+    history = _History(block_store)
+    exclusions = _anomaly_intervals(int(max_exclusion_seconds * 1000), guard_ms)
+
+    conn = get_connection()
+    if full:
+        conn.execute("DELETE FROM baseline_profiles")
+        conn.execute("DELETE FROM baseline_watermarks")
+        conn.commit()
+    watermarks = dict(conn.execute("SELECT device_id, through_ms FROM baseline_watermarks").fetchall())
+    conn.close()
+
+    processed = 0
+    for device_id in _stored_devices(block_store):
+        since = watermarks.get(device_id)
+        # Also read the day before the watermark so the clipping reference,
+        # the day up to the newest reading, is complete.
+        start = format_ts_ms(since - DAY_SECONDS * 1000) if since is not None else None
+        timestamps, columns = history.get_series(device_id, start, None)
+        if not len(timestamps):
+            continue
+        reference = timestamps >= timestamps.max() - DAY_SECONDS * 1000
+        limits = {metric: _robust_limits(values[reference], clip_sigma)
+                  for metric, values in columns.items()}
+        if since is not None:
+            newer = timestamps > since
+            timestamps = timestamps[newer]
+            columns = {metric: values[newer] for metric, values in columns.items()}
+        through = int(timestamps.max()) - guard_ms if len(timestamps) else None
+        if through is None or (since is not None and through <= since):
+            continue
+
+        outlier = np.zeros(len(timestamps), dtype=bool)
+        for metric, (low, high) in limits.items():
+            outlier |= (columns[metric] < low) | (columns[metric] > high)
+        outlier_ts = timestamps[outlier]
+        normal = timestamps <= through
+        if len(outlier_ts):
+            i = np.searchsorted(outlier_ts, timestamps)
+            before = outlier_ts[np.maximum(i - 1, 0)]
+            after = outlier_ts[np.minimum(i, len(outlier_ts) - 1)]
+            nearest = np.minimum(np.abs(timestamps - before), np.abs(after - timestamps))
+            normal &= nearest > guard_ms
+        for lo, hi in exclusions.get(device_id, ()):
+            normal &= (timestamps < lo) | (timestamps > hi)
+        timestamps = timestamps[normal]
+        columns = {metric: values[normal] for metric, values in columns.items()}
+        buckets = _bucket_index(timestamps, bucket_seconds)
+
+        rows = []
+        existing = _load_device(device_id, n_buckets)
+        for metric in METRICS:
+            values = columns[metric]
+            valid = ~np.isnan(values)
+            b, x = buckets[valid], values[valid]
+            count = np.bincount(b, minlength=n_buckets).astype(np.float64)
+            total = np.bincount(b, weights=x, minlength=n_buckets)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.where(count > 0, total / count, 0.0)
+            m2 = np.bincount(b, weights=(x - mean[b]) ** 2, minlength=n_buckets)
+
+            # Chan et al. parallel merge of (count, mean, M2) aggregates.
+            old_count, old_mean, old_m2 = existing[metric]
+            new_count = old_count + count
+            delta = mean - old_mean
+            with np.errstate(invalid="ignore", divide="ignore"):
+                merged_mean = np.where(new_count > 0,
+                                       old_mean + delta * count / new_count, 0.0)
+                merged_m2 = np.where(new_count > 0,
+                                     old_m2 + m2 + delta ** 2 * old_count * count / new_count, 0.0)
+
+            for bucket in np.flatnonzero(count):
+                rows.append((device_id, metric, int(bucket), int(new_count[bucket]),
+                             float(merged_mean[bucket]), float(merged_m2[bucket])))
+
+        conn = get_connection()
+        conn.executemany("""
+            INSERT INTO baseline_profiles (device_id, metric, bucket, count, mean, m2)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (device_id, metric, bucket)
+            DO UPDATE SET count = excluded.count, mean = excluded.mean, m2 = excluded.m2
+        """, rows)
+        conn.execute("""
+            INSERT INTO baseline_watermarks (device_id, through_ms) VALUES (?, ?)
+            ON CONFLICT (device_id) DO UPDATE SET through_ms = excluded.through_ms
+        """, (device_id, through))
+        conn.commit()
+        conn.close()
+        processed += len(timestamps)
+    return processed
+
+
+def _load_device(device_id, n_buckets):
+    existing = {
+        metric: (np.zeros(n_buckets), np.zeros(n_buckets), np.zeros(n_buckets))
+        for metric in METRICS
+    }
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT metric, bucket, count, mean, m2 FROM baseline_profiles WHERE device_id = ?",
+        (device_id,),
+    ).fetchall()
+    conn.close()
+    for metric, bucket, count, mean, m2 in rows:
+        if metric in existing and bucket < n_buckets:
+            existing[metric][0][bucket] = count
+            existing[metric][1][bucket] = mean
+            existing[metric][2][bucket] = m2
+    return existing
+
+
+class BaselineProfiles:
+    """
+    In-memory copy of baseline_profiles for constant-time scoring.
+
+    lookup() returns the (mean, std) of the bucket a reading's time of day
+    falls into, or None when that bucket has fewer than `min_count` samples,
+    in which case the detector falls back to its sliding window.
+    """
+
+    def __init__(self, block_store=None, bucket_seconds: int = 900,
+                 min_count: int = 30, refresh_interval: float = 600.0,
+                 max_exclusion_seconds: float = 7200.0, clip_sigma: float = 4.0):
+        self.block_store = block_store
+        self.bucket_seconds = bucket_seconds
+        self.min_count = min_count
+        self.refresh_interval = refresh_interval
+        self.max_exclusion_seconds = max_exclusion_seconds
+        self.clip_sigma = clip_sigma
+        self._table = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """Replace the in-memory tables with the current contents of baseline_profiles."""
+        n_buckets = DAY_SECONDS // self.bucket_seconds
+        table = {}
+        conn = get_connection()
+        rows = conn.execute(
+            "SELECT device_id, metric, bucket, count, mean, m2 FROM baseline_profiles"
+        ).fetchall()
+        conn.close()
+        for device_id, metric, bucket, count, mean, m2 in rows:
+            if bucket >= n_buckets or count < self.min_count:
+                continue
+            buckets = table.setdefault((device_id, metric), [None] * n_buckets)
+            buckets[bucket] = (mean, (m2 / count) ** 0.5)
+        self._table = table
+
+    def refresh(self):
+        """Fold in newly stored readings, then reload."""
+        refresh_profiles(self.block_store, self.bucket_seconds,
+                         max_exclusion_seconds=self.max_exclusion_seconds,
+                         clip_sigma=self.clip_sigma)
+        self.load()
+
+    def lookup(self, device_id, metric, ts_ms):
+        buckets = self._table.get((device_id, metric))
+        if buckets is None:
+            return None
+        return buckets[(ts_ms // 1000 % DAY_SECONDS) // self.bucket_seconds]
+
+    def start(self):
+        """Load the profiles and keep refreshing them in the background."""
+        self.load()
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Baseline refresh failed: {e}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    import config
+    from db import init_db
+
+    init_db()
+    store = None
+    if config.READING_STORAGE == "blocks":
+        from blockstore import BlockStore
+        store = BlockStore(chunk_seconds=config.BLOCK_CHUNK_SECONDS)
+    n = refresh_profiles(store, config.BASELINE_BUCKET_SECONDS, full="--full" in sys.argv[1:],
+                         max_exclusion_seconds=config.BASELINE_OPTIONS["max_exclusion_seconds"],
+                         clip_sigma=config.BASELINE_OPTIONS["clip_sigma"])
+    print(f"Folded {n} readings into baseline profiles")
@@ -0,0 +1,347 @@
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from db import get_connection
+from history import METRICS
+from timeutil import format_ts_ms, parse_ts_ms
+
+_F64 = struct.Struct("<d")
+_U64 = struct.Struct("<Q")
+_MASK64 = (1 << 64) - 1
+_WINDOW_BYTES = 24
+
+
+class _BitWriter:
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._n = 0
+
+    def write(self, value: int, nbits: int):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._n += nbits
+        while self._n >= 8:
+            self._n -= 8
+            self._buf.append((self._acc >> self._n) & 0xFF)
+        self._acc &= (1 << self._n) - 1
+
+    def getvalue(self) -> bytes:
+        if self._n:
+            return bytes(self._buf) + bytes([(self._acc << (8 - self._n)) & 0xFF])
+        return bytes(self._buf)
+
+
+# Delta-of-delta buckets: (control prefix, prefix length, payload bits) for a
+# zigzag-encoded dod. A steady 5 s sampling interval costs one bit per point.
+_DOD_BUCKETS = [(0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12)]
+
+
+def encode_block(timestamps_ms, values) -> bytes:
+    """
+    Gorilla-style encoding of one series: the first timestamp and value are
+    stored raw, then each timestamp as a delta-of-delta and each value as the
+    XOR with its predecessor, keeping only the meaningful bits.
+    """
+    w = _BitWriter()
+    prev_ts = prev_delta = prev_bits = None
+    prev_lead = prev_trail = None
+
+    for ts, value in zip(timestamps_ms, values):
+        bits = _U64.unpack(_F64.pack(value))[0]
+        if prev_ts is None:
+            w.write(ts & _MASK64, 64)
+            w.write(bits, 64)
+            prev_ts, prev_delta, prev_bits = ts, 0, bits
+            continue
+
+        delta = ts - prev_ts
+        dod = delta - prev_delta
+        zz = ((dod << 1) ^ (dod >> 63)) & _MASK64
+        if zz == 0:
+            w.write(0, 1)
+        else:
+            for prefix, prefix_len, payload in _DOD_BUCKETS:
+                if zz < (1 << payload):
+                    w.write(prefix, prefix_len)
+                    w.write(zz, payload)
+                    break
+            else:
+                w.write(0b1111, 4)
+                w.write(zz, 64)
+        prev_ts, prev_delta = ts, delta
+
+        xor = bits ^ prev_bits
+        if xor == 0:
+            w.write(0, 1)
+        else:
+            lead = min(64 - xor.bit_length(), 31)
+            trail = (xor & -xor).bit_length() - 1
+            if prev_lead is not None and lead >= prev_lead and trail >= prev_trail:
+                w.write(0b10, 2)
+                w.write(xor >> prev_trail, 64 - prev_lead - prev_trail)
+            else:
+                meaningful = 64 - lead - trail
+                w.write(0b11, 2)
+                w.write(lead, 5)
+                w.write(meaningful - 1, 6)
+                w.write(xor >> trail, meaningful)
+                prev_lead, prev_trail = lead, trail
+        prev_bits = bits
+
+    return w.getvalue()
+
+
+def decode_block(data: bytes, count: int):
+    """
+    Inverse of encode_block(). Returns (int64 epoch-ms array, float64 value array).
+
+    Instead of reading bit by bit, each point's fields are sliced out of one
+    192-bit window (wide enough for the largest encoded point) taken at the
+    current byte offset, which keeps the per-point work to a few small-int shifts.
+    """
+    if count == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    buf = bytes(data) + bytes(_WINDOW_BYTES)
+    head = int.from_bytes(buf[:16], "big")
+    ts, bits = head >> 64, head & _MASK64
+    timestamps, raw = [ts], [bits]
+    delta = lead = trail = 0
+    pos = 128
+    window = _WINDOW_BYTES * 8
+    for _ in range(count - 1):
+        w = int.from_bytes(buf[pos >> 3:(pos >> 3) + _WINDOW_BYTES], "big")
+        start = avail = window - (pos & 7)
+        avail -= 1
+        if (w >> avail) & 1:
+            avail -= 1
+            if not (w >> avail) & 1:
+                k = 7
+            else:
+                avail -= 1
+                if not (w >> avail) & 1:
+                    k = 9
+                else:
+                    avail -= 1
+                    k = 64 if (w >> avail) & 1 else 12
+            avail -= k
+            zz = (w >> avail) & ((1 << k) - 1)
+            delta += (zz >> 1) ^ -(zz & 1)
+        ts += delta
+        timestamps.append(ts)
+        avail -= 1
+        if (w >> avail) & 1:
+            avail -= 1
+            if (w >> avail) & 1:
+                avail -= 11
+                f = (w >> avail) & 0x7FF
+                lead = f >> 6
+                trail = 63 - lead - (f & 0x3F)
+            k = 64 - lead - trail
+            avail -= k
+            bits ^= ((w >> avail) & ((1 << k) - 1)) << trail
+        raw.append(bits)
+        pos += start - avail
+    return np.array(timestamps, dtype=np.int64), np.array(raw, dtype=np.uint64).view(np.float64)
+
+
+class BlockStore:
+    """
+    Compressed columnar storage for raw sensor history.
+
+    Readings are buffered per device and metric and sealed into a block once
+    a reading falls into the next fixed-duration chunk, once the buffer has
+    been open for `max_open_seconds` of wall-clock time, or on flush(). The
+    age limit bounds what a crash can lose and how far other processes
+    reading the table lag behind; start() runs a thread that enforces it for
+    devices that have gone quiet. Each block is one row in reading_blocks
+    holding a Gorilla-encoded blob, so every reading can be kept at a
+    fraction of the cost of sensor_readings. Range reads only decode the
+    blocks they overlap.
+    """
+
+    def __init__(self, chunk_seconds: int = 900, max_open_seconds: float = 60.0):
+        self.chunk_ms = int(chunk_seconds * 1000)
+        self.max_open_seconds = max_open_seconds
+        self._lock = threading.Lock()
+        # device_id -> [chunk index, [timestamps], {metric: [values]}, opened at (monotonic)]
+        self._open = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def append(self, reading: dict):
+        """Buffer one reading; seals the device's open block when its chunk rolls over or it ages out."""
+        device_id = reading["device_id"]
+        ts = parse_ts_ms(reading["timestamp"])
+        chunk = ts // self.chunk_ms
+        now = time.monotonic()
+
+        with self._lock:
+            buf = self._open.get(device_id)
+            sealed = None
+            # A replay that loops back in time also starts a new block, so
+            # timestamps within a block are always non-decreasing.
+            if buf is not None and (buf[0] != chunk or ts < buf[1][-1]
+                                    or now - buf[3] >= self.max_open_seconds):
+                sealed = self._open.pop(device_id)
+                buf = None
+            if buf is None:
+                buf = self._open[device_id] = [chunk, [], {m: [] for m in METRICS}, now]
+            buf[1].append(ts)
+            for metric in METRICS:
+                value = reading.get(metric)
+                buf[2][metric].append(float("nan") if value is None else float(value))
+
+        if sealed is not None:
+            self._write({device_id: sealed})
+
+    def flush(self):
+        """Seal and persist every open chunk."""
+        with self._lock:
+            open_chunks, self._open = self._open, {}
+        self._write(open_chunks)
+
+    def seal_expired(self):
+        """Seal and persist the open chunks older than max_open_seconds."""
+        cutoff = time.monotonic() - self.max_open_seconds
+        with self._lock:
+            expired = {device_id: self._open.pop(device_id)
+                       for device_id, buf in list(self._open.items()) if buf[3] <= cutoff}
+        self._write(expired)
+
+    def start(self):
+        """Seal aged chunks in the background; only the process that appends needs this."""
+        self._thread = threading.Thread(target=self._seal_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background sealer and flush everything still open."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def devices(self) -> list:
+        conn = get_connection()
+        rows = conn.execute("SELECT DISTINCT device_id FROM reading_blocks").fetchall()
+        conn.close()
+        with self._lock:
+            open_devices = set(self._open)
+        return sorted({r[0] for r in rows} | open_devices)
+
+    def read_range(self, device_id: str, metric: str, start: str = None, end: str = None):
+        """
+        All readings of one metric for a device with start <= timestamp <= end
+        (ISO strings, either bound optional). Returns (int64 epoch-ms array,
+        float64 array) sorted by time.
+        """
+        lo = parse_ts_ms(start) if start else -(1 << 62)
+        hi = parse_ts_ms(end) if end else 1 << 62
+
+        conn = get_connection()
+        rows = conn.execute("""
+            SELECT count, data FROM reading_blocks
+            WHERE device_id = ? AND metric = ? AND block_end >= ? AND block_start <= ?
+            ORDER BY block_start, id
+        """, (device_id, metric, lo, hi)).fetchall()
+        conn.close()
+
+        parts = [decode_block(data, count) for count, data in rows]
+        with self._lock:
+            buf = self._open.get(device_id)
+            if buf is not None and buf[1] and buf[1][-1] >= lo and buf[1][0] <= hi:
+                parts.append((np.array(buf[1], dtype=np.int64),
+                              np.array(buf[2][metric], dtype=np.float64)))
+
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        ts = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        order = np.argsort(ts, kind="stable")
+        ts, values = ts[order], values[order]
+        keep = (ts >= lo) & (ts <= hi)
+        return ts[keep], values[keep]
+
+    def read_recent(self, device_ids, limit: int = 50) -> dict:
+        """
+        The newest `limit` readings for each device, newest first, in the same
+        row shape as sensor_readings. Fetches just enough trailing blocks for
+        every device and metric in a single query.
+        """
+        device_ids = list(device_ids)
+        result = {device_id: {} for device_id in device_ids}
+        if not device_ids or limit <= 0:
+            return {device_id: [] for device_id in device_ids}
+
+        with self._lock:
+            for device_id in device_ids:
+                buf = self._open.get(device_id)
+                if buf is None:
+                    continue
+                for i in range(len(buf[1]) - 1, max(len(buf[1]) - limit, 0) - 1, -1):
+                    result[device_id][buf[1][i]] = {m: buf[2][m][i] for m in METRICS}
+
+        placeholders = ", ".join("?" for _ in device_ids)
+        conn = get_connection()
+        rows = conn.execute(f"""
+            SELECT device_id, metric, count, data FROM (
+                SELECT device_id, metric, count, data,
+                       SUM(count) OVER (
+                           PARTITION BY device_id, metric
+                           ORDER BY block_end DESC, id DESC
+                           ROWS UNBOUNDED PRECEDING
+                       ) AS upto
+                FROM reading_blocks
+                WHERE device_id IN ({placeholders})
+            )
+            WHERE upto - count < ?
+        """, (*device_ids, limit)).fetchall()
+        conn.close()
+
+        for device_id, metric, count, data in rows:
+            timestamps, values = decode_block(data, count)
+            readings = result[device_id]
+            for ts, value in zip(timestamps.tolist(), values.tolist()):
+                readings.setdefault(ts, {})[metric] = value
+
+        out = {}
+        for device_id, readings in result.items():
+            newest = sorted(readings, reverse=True)[:limit]
+            out[device_id] = [
+                {"timestamp": format_ts_ms(ts),
+                 **{m: _none_if_nan(readings[ts].get(m)) for m in METRICS}}
+                for ts in newest
+            ]
+        return out
+
+    def _write(self, chunks: dict):
+        rows = []
+        for device_id, (_, timestamps, series, _) in chunks.items():
+            if not timestamps:
+                continue
+            for metric in METRICS:
+                rows.append((device_id, metric, timestamps[0], timestamps[-1],
+                             len(timestamps), encode_block(timestamps, series[metric])))
+        if not rows:
+            return
+        conn = get_connection()
+        conn.executemany("""
+            INSERT INTO reading_blocks (device_id, metric, block_start, block_end, count, data)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        conn.close()
+
+    def _seal_loop(self):
+        while not self._stop_event.wait(max(self.max_open_seconds / 2, 0.1)):
+            try:
+                self.seal_expired()
+            except Exception as e:
+                print(f"Block seal failed: {e}", file=sys.stderr)
+
+
+def _none_if_nan(value):
+    return None if value is None or value != value else value
@@ -0,0 +1,128 @@
+import json
+import os
+import struct
+import tempfile
+import time
+
+# File layout (little-endian):
+#   header   magic "AGCK", u16 version, u16 metric count, u32 device count, f64 saved_at
+#   metrics  per metric: u16 name length, utf-8 name
+#   devices  per device: u16 id length, utf-8 id, u64 read counter,
+#            then per metric: u16 sample count, sample count x f64
+#   extras   u32 length, utf-8 JSON {"active_anomalies": ..., "latest_readings": ...}
+MAGIC = b"AGCK"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHHId")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+
+class CheckpointError(Exception):
+    """Raised when a checkpoint file is missing, truncated or from another version."""
+
+
+def save_checkpoint(path: str, state: dict):
+    """
+    Atomically write detector state to `path`.
+
+    `state` is the dict returned by AnomalyDetector.snapshot(). The file is
+    written next to the target and renamed into place, so a crash mid-write
+    leaves the previous checkpoint intact.
+    """
+    metrics = state["metrics"]
+    windows = state["windows"]
+    counters = state["read_counters"]
+    devices = sorted(set(windows) | set(counters))
+
+    parts = [_HEADER.pack(MAGIC, VERSION, len(metrics), len(devices), time.time())]
+    for metric in metrics:
+        name = metric.encode()
+        parts += [_U16.pack(len(name)), name]
+
+    for device_id in devices:
+        name = device_id.encode()
+        parts += [_U16.pack(len(name)), name, _U64.pack(counters.get(device_id, 0))]
+        device_windows = windows.get(device_id, {})
+        for metric in metrics:
+            values = device_windows.get(metric, ())
+            parts += [_U16.pack(len(values)), struct.pack(f"<{len(values)}d", *values)]
+
+    extras = json.dumps({
+        "active_anomalies": state["active_anomalies"],
+        "latest_readings":  state["latest_readings"],
+    }).encode()
+    parts += [_U32.pack(len(extras)), extras]
+
+    # A private temp file per writer, so processes sharing a checkpoint path
+    # never write into each other's half-finished file.
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"".join(parts))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_checkpoint(path: str) -> dict:
+    """Read a checkpoint written by save_checkpoint() back into a state dict."""
+    try:
+        with open(path, "rb") as f:
+            buf = f.read()
+    except OSError as e:
+        raise CheckpointError(f"cannot read {path}: {e}") from e
+
+    try:
+        magic, version, n_metrics, n_devices, saved_at = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise CheckpointError(f"{path} is not a version {VERSION} detector checkpoint")
+        pos = _HEADER.size
+
+        metrics = []
+        for _ in range(n_metrics):
+            (n,) = _U16.unpack_from(buf, pos)
+            pos += _U16.size
+            metrics.append(buf[pos:pos + n].decode())
+            pos += n
+
+        windows, counters = {}, {}
+        for _ in range(n_devices):
+            (n,) = _U16.unpack_from(buf, pos)
+            pos += _U16.size
+            device_id = buf[pos:pos + n].decode()
+            pos += n
+            (counters[device_id],) = _U64.unpack_from(buf, pos)
+            pos += _U64.size
+
+            windows[device_id] = {}
+            for metric in metrics:
+                (count,) = _U16.unpack_from(buf, pos)
+                pos += _U16.size
+                windows[device_id][metric] = list(struct.unpack_from(f"<{count}d", buf, pos))
+                pos += 8 * count
+
+        (n,) = _U32.unpack_from(buf, pos)
+        pos += _U32.size
+        if pos + n != len(buf):
+            raise CheckpointError(f"{path} is truncated")
+        extras = json.loads(buf[pos:pos + n])
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        raise CheckpointError(f"{path} is corrupt: {e}") from e
+
+    return {
+        "saved_at":         saved_at,
+        "metrics":          metrics,
+        "windows":          windows,
+        "read_counters":    counters,
+        "active_anomalies": extras["active_anomalies"],
+        "latest_readings":  extras["latest_readings"],
+    }
@@ -0,0 +1,76 @@
+"""Environment-driven settings shared by the MCP server and the ingest daemon."""
+import os
+import tempfile
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_DATA_DIR = os.path.join(_HERE, "data")
+
+
+def _flag(name, default="0"):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+def _default_state_path():
+    shm = "/dev/shm"
+    base = shm if os.path.isdir(shm) else tempfile.gettempdir()
+    return os.path.join(base, "aegisflow-state")
+
+
+CSV_PATH = os.path.join(_DATA_DIR, "sensor_data.csv")
+MANUAL_PATH = os.path.join(_DATA_DIR, "device_manual.md")
+
+BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", "1883"))
+SPEED_MULTIPLIER = float(os.getenv("SPEED_MULTIPLIER", "100"))
+ENABLE_SIMULATOR = _flag("ENABLE_SIMULATOR")
+
+CHECKPOINT_PATH = os.getenv("DETECTOR_CHECKPOINT_PATH", "detector_state.ckpt") or None
+CHECKPOINT_INTERVAL = float(os.getenv("DETECTOR_CHECKPOINT_INTERVAL", "30"))
+
+# 'rows' keeps the readings chosen by PERSISTENCE_POLICY in sensor_readings
+# (adaptive by default: deadband plus full-rate capture around anomalies);
+# 'blocks' keeps every reading in Gorilla-compressed reading_blocks (see blockstore.py).
+READING_STORAGE = os.getenv("READING_STORAGE", "rows").lower()
+BLOCK_CHUNK_SECONDS = int(os.getenv("BLOCK_CHUNK_SECONDS", "900"))
+# Wall-clock age at which a partially filled block is sealed anyway; bounds
+# the readings lost on a crash and how far attached servers lag behind.
+BLOCK_MAX_OPEN_SECONDS = float(os.getenv("BLOCK_MAX_OPEN_SECONDS", "60"))
+
+# Which readings reach sensor_readings in 'rows' storage (see sampling.py).
+PERSISTENCE_POLICY = os.getenv("PERSISTENCE_POLICY", "adaptive").lower()
+PERSISTENCE_OPTIONS = {
+    "deadband_sigma": float(os.getenv("PERSIST_DEADBAND_SIGMA", "4.0")),
+    "max_interval":   float(os.getenv("PERSIST_MAX_INTERVAL", "120")),
+    "pre_trigger":    int(os.getenv("PERSIST_PRE_TRIGGER", "24")),
+    "post_trigger":   int(os.getenv("PERSIST_POST_TRIGGER", "60")),
+}
+
+# 'window' scores readings against each device's sliding window; 'profile'
+# scores them against time-of-day baselines built by baselines.py, falling
+# back to the window for buckets with too little history. 'profile' requires
+# READING_STORAGE=blocks: the profiles are built from stored readings, and the
+# sampled rows store leaves almost no bucket with BASELINE_MIN_COUNT of them.
+DETECTION_MODE = os.getenv("DETECTION_MODE", "window").lower()
+BASELINE_BUCKET_SECONDS = int(float(os.getenv("BASELINE_BUCKET_MINUTES", "15")) * 60)
+BASELINE_OPTIONS = {
+    "bucket_seconds":   BASELINE_BUCKET_SECONDS,
+    "min_count":        int(os.getenv("BASELINE_MIN_COUNT", "30")),
+    "refresh_interval": float(os.getenv("BASELINE_REFRESH_INTERVAL", "600")),
+    # Readings after a detected anomaly are left out of the profiles until it
+    # is resolved, for at most this long.
+    "max_exclusion_seconds": float(os.getenv("BASELINE_MAX_EXCLUSION_MINUTES", "120")) * 60,
+    # Values further than this many robust std devs from the device's
+    # trailing-day median are not learned; 0 disables clipping.
+    "clip_sigma":       float(os.getenv("BASELINE_CLIP_SIGMA", "4")),
+}
+
+# 'embedded' runs MQTT + detector inside the MCP server process (the default);
+# 'attached' reads the live state published by ingest_daemon.py instead.
+DETECTOR_MODE = os.getenv("DETECTOR_MODE", "embedded").lower()
+STATE_PATH = os.getenv("AEGISFLOW_STATE_PATH") or _default_state_path()
+STATE_SIZE = int(os.getenv("AEGISFLOW_STATE_SIZE", str(4 * 1024 * 1024)))
+STATE_PUBLISH_INTERVAL = float(os.getenv("AEGISFLOW_STATE_PUBLISH_INTERVAL", "0.25"))
+# Unix socket on which the daemon answers query_device_manual for attached servers.
+MANUAL_SOCKET_PATH = os.getenv("AEGISFLOW_MANUAL_SOCKET") or STATE_PATH + ".manual.sock"
+# Attached servers treat the daemon as gone after this many seconds without an update.
+STATE_STALE_SECONDS = float(os.getenv("AEGISFLOW_STATE_STALE_SECONDS", "5"))
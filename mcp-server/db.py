@@ -53,8 +53,45 @@ def init_db():
         )
     """)
 
+    # Gorilla-compressed blocks of raw readings, one row per device, metric and
+    # chunk (see blockstore.py). block_start/block_end are epoch milliseconds.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reading_blocks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            block_start INTEGER NOT NULL,
+            block_end INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    """)
+
+    # Time-of-day baselines (see baselines.py): running count, mean and sum of
+    # squared deviations per device, metric and bucket of the day.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS baseline_profiles (
+            device_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            m2 REAL NOT NULL,
+            PRIMARY KEY (device_id, metric, bucket)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS baseline_watermarks (
+            device_id TEXT PRIMARY KEY,
+            through_ms INTEGER NOT NULL
+        )
+    """)
+
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_readings_device_ts ON sensor_readings(device_id, timestamp)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_device ON anomalies(device_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_device_detected ON anomalies(device_id, detected_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_blocks_device_metric_end ON reading_blocks(device_id, metric, block_end)")
 
     conn.commit()
     conn.close()
@@ -62,5 +99,79 @@ def init_db():
 def get_connection():
     return sqlite3.connect(DB_PATH)
 
+def fetch_recent_readings(device_id, limit=50):
+    """Most recent stored readings for a device, newest first."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT timestamp, temperature, pressure, vibration, humidity, power_consumption
+        FROM sensor_readings
+        WHERE device_id = ?
+        ORDER BY timestamp DESC
+        LIMIT ?
+    """, (device_id, limit))
+    columns = [desc[0] for desc in cursor.description]
+    results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    conn.close()
+    return results
+
+
+def fetch_device_ids():
+    """Every device id with stored readings or anomalies in SQLite."""
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT device_id FROM sensor_readings
+        UNION
+        SELECT device_id FROM anomalies
+    """).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
 
 
+def fetch_readings_range(device_id, start=None, end=None):
+    """Stored readings for a device with start <= timestamp <= end, oldest first, as tuples."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT timestamp, temperature, pressure, vibration, humidity, power_consumption
+        FROM sensor_readings
+        WHERE device_id = ?
+          AND (? IS NULL OR timestamp >= ?)
+          AND (? IS NULL OR timestamp <= ?)
+        ORDER BY timestamp
+    """, (device_id, start, start, end, end))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def fetch_recent_readings_bulk(device_ids, limit=50):
+    """
+    Most recent stored readings for several devices in one query, newest
+    first, capped at `limit` per device. Returns {device_id: [rows]}.
+    """
+    device_ids = list(device_ids)
+    results = {device_id: [] for device_id in device_ids}
+    if not device_ids:
+        return results
+
+    placeholders = ", ".join("?" for _ in device_ids)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT device_id, timestamp, temperature, pressure, vibration, humidity, power_consumption
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY device_id ORDER BY timestamp DESC
+            ) AS rn
+            FROM sensor_readings
+            WHERE device_id IN ({placeholders})
+        )
+        WHERE rn <= ?
+        ORDER BY device_id, timestamp DESC
+    """, (*device_ids, limit))
+    columns = [desc[0] for desc in cursor.description][1:]
+    for device_id, *row in cursor.fetchall():
+        results[device_id].append(dict(zip(columns, row)))
+    conn.close()
+    return results
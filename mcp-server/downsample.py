@@ -0,0 +1,119 @@
+import numpy as np
+
+# Approximate LLM token cost of one point in the columnar response (a time
+# offset plus five values rounded to three decimals) as FastMCP sends it: once
+# in the indented JSON text, where every array element sits on its own line
+# (~65 characters per point), and once as structured content (~35). Digit-heavy
+# JSON tokenizes poorly, so this errs on the high side.
+TOKENS_PER_POINT = 90
+
+
+def lttb(x: np.ndarray, ys: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets over one or more series sharing an x axis.
+
+    `ys` has shape (n, m). Each series is z-normalized and the triangle areas
+    are summed across series, so the chosen points preserve the shape of all
+    metrics at once. Returns at most `n_out` sorted indices into x, including
+    the first and last point whenever n_out >= 2.
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    std = np.nanstd(ys, axis=0)
+    std[~np.isfinite(std) | (std == 0)] = 1.0
+    y = np.nan_to_num((ys - np.nanmean(ys, axis=0)) / std)
+    x = x.astype(np.float64)
+
+    every = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start = end
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_start >= next_end:
+            next_start, next_end = n - 1, n
+
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean(axis=0)
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end, None]) * (avg_y - y[a])
+        ).sum(axis=1)
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def minmax(x: np.ndarray, ys: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Min/max per bucket: split the series into equal-count buckets and keep each
+    metric's extremes in every bucket, so no spike is lost. Returns at most
+    `n_out` sorted indices; when that is too few for one bucket (2 per metric
+    plus the endpoints) it falls back to lttb.
+    """
+    n, m = ys.shape
+    if n_out >= n:
+        return np.arange(n)
+
+    n_buckets = (n_out - 2) // (2 * m)
+    if n_buckets < 1:
+        return lttb(x, ys, n_out)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    keep = [0, n - 1]
+    low = np.where(np.isnan(ys), np.inf, ys)
+    high = np.where(np.isnan(ys), -np.inf, ys)
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        keep.extend((lo + low[lo:hi].argmin(axis=0)).tolist())
+        keep.extend((lo + high[lo:hi].argmax(axis=0)).tolist())
+    return np.unique(np.array(keep, dtype=np.int64))
+
+
+METHODS = {"lttb": lttb, "minmax": minmax}
+
+
+def reduce_series(timestamps: np.ndarray, columns: dict, max_points: int,
+                  method: str = "lttb", keep_timestamps=(), context: int = 3,
+                  max_forced_share: float = 0.5) -> np.ndarray:
+    """
+    Pick at most `max_points` indices that preserve the shape of all columns.
+
+    Points within `context` samples of each timestamp in `keep_timestamps` are
+    kept as well, but they count against `max_points` and may take at most
+    `max_forced_share` of it: when there are too many, the points nearest each
+    timestamp win, so every anomaly keeps at least its own reading while room
+    remains.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}; expected one of {sorted(METHODS)}")
+    n = len(timestamps)
+    if n == 0:
+        return np.arange(0)
+
+    centers = np.searchsorted(timestamps, np.asarray(list(keep_timestamps), dtype=np.int64))
+    centers = np.minimum(centers, n - 1)
+    # Leave the reduction at least the two endpoints.
+    cap = max(min(int(max_points * max_forced_share), max_points - 2), 0)
+    forced = set()
+    for distance in range(context + 1):
+        for i in centers.tolist():
+            for j in {i - distance, i + distance}:
+                if len(forced) >= cap:
+                    break
+                if 0 <= j < n:
+                    forced.add(j)
+
+    budget = max_points - len(forced)
+    ys = np.column_stack([columns[m] for m in columns])
+    selected = METHODS[method](timestamps, ys, budget)
+    if forced:
+        selected = np.union1d(selected, np.fromiter(forced, dtype=np.int64))
+    return selected
@@ -0,0 +1,60 @@
+from db import fetch_device_ids, fetch_readings_range, fetch_recent_readings, fetch_recent_readings_bulk
+
+METRICS = ["temperature", "pressure", "vibration", "humidity", "power_consumption"]
+
+
+class StoredReadingsMixin:
+    """
+    Read access to persisted sensor history, shared by AnomalyDetector and
+    SharedDetectorView. Reads from `self.block_store` when one is configured,
+    otherwise from the sensor_readings table.
+    """
+
+    block_store = None
+
+    def get_recent_readings(self, device_id, limit=50):
+        """Fetch recent stored readings for a device from SQLite."""
+        if self.block_store is not None:
+            return self.block_store.read_recent([device_id], limit)[device_id]
+        return fetch_recent_readings(device_id, limit)
+
+    def get_recent_readings_bulk(self, device_ids, limit=50):
+        """Fetch recent stored readings for several devices in one query."""
+        if self.block_store is not None:
+            return self.block_store.read_recent(device_ids, limit)
+        return fetch_recent_readings_bulk(device_ids, limit)
+
+    def get_stored_devices(self):
+        """Device ids with any stored history, including ones not reporting right now."""
+        device_ids = set(fetch_device_ids())
+        if self.block_store is not None:
+            device_ids.update(self.block_store.devices())
+        return sorted(device_ids)
+
+    def get_series(self, device_id, start=None, end=None):
+        """
+        Stored readings for a device between two ISO timestamps as columns:
+        (int64 epoch-ms array, {metric: float64 array}), oldest first.
+        Missing values are NaN.
+        """
+        import numpy as np
+        from timeutil import format_ts_ms, parse_ts_ms
+
+        if self.block_store is not None:
+            columns = {}
+            timestamps = None
+            for metric in METRICS:
+                timestamps, columns[metric] = self.block_store.read_range(device_id, metric, start, end)
+            return timestamps, columns
+
+        # sensor_readings stores timestamps as text in the simulator's format,
+        # so normalize the bounds to that format before comparing.
+        start = format_ts_ms(parse_ts_ms(start)) if start else None
+        end = format_ts_ms(parse_ts_ms(end)) if end else None
+        rows = fetch_readings_range(device_id, start, end)
+        timestamps = np.array([parse_ts_ms(r[0]) for r in rows], dtype=np.int64)
+        columns = {
+            metric: np.array([np.nan if r[i] is None else r[i] for r in rows], dtype=np.float64)
+            for i, metric in enumerate(METRICS, start=1)
+        }
+        return timestamps, columns
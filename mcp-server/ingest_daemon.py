@@ -0,0 +1,61 @@
+"""
+Local ingest daemon: one MQTT subscriber and one AnomalyDetector for the
+whole host, publishing live state to a shared-memory segment.
+
+Run this once, then start any number of MCP servers with
+DETECTOR_MODE=attached; they read the segment instead of running their own
+MQTT client, detector and simulator, and send manual queries to the one
+embedding model loaded here.
+"""
+import signal
+import sys
+import threading
+
+import config
+from db import init_db
+from lifecycle import Runtime
+from manual_service import ManualServer
+from shared_state import SharedStateWriter, StatePublisher
+
+
+def main():
+    try:
+        runtime = Runtime.from_config(detector_mode="embedded")
+        writer = SharedStateWriter(config.STATE_PATH, config.STATE_SIZE)
+    except (ValueError, RuntimeError) as e:
+        raise SystemExit(str(e))
+
+    init_db()
+
+    detector = runtime.detector
+    detector.on_anomaly_detected = lambda info: print(
+        f"ANOMALY DETECTED: {info['device_id']} — {info['severity'].upper()}")
+    simulator = runtime.simulator
+
+    publisher = StatePublisher(detector, writer, interval=config.STATE_PUBLISH_INTERVAL)
+    manual = ManualServer(config.MANUAL_SOCKET_PATH, config.MANUAL_PATH)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    manual.start()
+    detector.start()
+    publisher.start()
+    if simulator is not None:
+        simulator.start()
+    print(f"Ingest daemon publishing live state to {config.STATE_PATH}")
+
+    stop.wait()
+
+    if simulator is not None:
+        simulator.stop()
+    detector.stop()
+    publisher.stop()
+    manual.stop()
+    writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+from db import init_db
+from anomaly_detector import AnomalyDetector
+from mqtt_simulator import MQTTSimulator
+from shared_state import SharedDetectorView
+
+
+class Runtime:
+    """
+    Owns the long-lived components behind the MCP tools.
+
+    Nothing heavy happens at construction time. start() initializes the
+    database, detector, optional simulator and the manual retriever in
+    parallel, each on its own daemon thread, so the MCP server can begin
+    answering tool calls immediately and can exit without waiting for a
+    slow component (e.g. the embedding model) to finish loading; tools that
+    need a component which is still loading block only on that component.
+
+    In 'attached' detector mode the process runs no MQTT client, detector,
+    simulator or embedding model of its own: it reads the state that
+    ingest_daemon.py publishes to shared memory and forwards manual queries
+    to the daemon's socket.
+    """
+
+    def __init__(self, csv_path: str, manual_path: str,
+                 broker_host: str = "localhost", broker_port: int = 1883,
+                 speed_multiplier: float = 100.0, enable_simulator: bool = False,
+                 checkpoint_path: str = None, checkpoint_interval: float = 30.0,
+                 detector_mode: str = "embedded", state_path: str = None,
+                 reading_storage: str = "rows", block_chunk_seconds: int = 900,
+                 block_max_open_seconds: float = 60.0,
+                 persistence=None, detection_mode: str = "window",
+                 baseline_options: dict = None, state_stale_seconds: float = 5.0,
+                 manual_socket_path: str = None):
+        self.csv_path = csv_path
+        self.manual_path = manual_path
+        self.detector_mode = detector_mode
+        self.manual_socket_path = manual_socket_path
+
+        if reading_storage not in ("rows", "blocks"):
+            raise ValueError(f"Unknown reading storage {reading_storage!r}; "
+                             f"expected 'rows' or 'blocks'")
+        self.block_store = None
+        if reading_storage == "blocks":
+            from blockstore import BlockStore
+            self.block_store = BlockStore(chunk_seconds=block_chunk_seconds,
+                                          max_open_seconds=block_max_open_seconds)
+
+        if detector_mode not in ("embedded", "attached"):
+            raise ValueError(f"Unknown detector mode {detector_mode!r}; "
+                             f"expected 'embedded' or 'attached'")
+        if detection_mode not in ("window", "profile"):
+            raise ValueError(f"Unknown detection mode {detection_mode!r}; "
+                             f"expected 'window' or 'profile'")
+        if detection_mode == "profile" and detector_mode == "embedded" and self.block_store is None:
+            raise ValueError("Detection mode 'profile' requires 'blocks' reading storage; "
+                             "sampled rows leave too few readings per bucket")
+        profiles = None
+        if detection_mode == "profile" and detector_mode == "embedded":
+            from baselines import BaselineProfiles
+            profiles = BaselineProfiles(self.block_store, **(baseline_options or {}))
+
+        if detector_mode == "attached":
+            self.detector = SharedDetectorView(state_path, block_store=self.block_store,
+                                               stale_after=state_stale_seconds)
+        else:
+            self.detector = AnomalyDetector(broker_host=broker_host, broker_port=broker_port,
+                                            checkpoint_path=checkpoint_path,
+                                            checkpoint_interval=checkpoint_interval,
+                                            block_store=self.block_store,
+                                            persistence=persistence,
+                                            profiles=profiles)
+        self.simulator = None
+        if enable_simulator and detector_mode == "attached":
+            print("Startup: ENABLE_SIMULATOR is ignored in attached mode; "
+                  "run the simulator in ingest_daemon.py", file=sys.stderr)
+        elif enable_simulator:
+            self.simulator = MQTTSimulator(csv_path, broker_host=broker_host,
+                                           broker_port=broker_port,
+                                           speed_multiplier=speed_multiplier)
+
+        self._futures = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._submitted = False
+        self._reported = False
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls, **overrides):
+        """
+        Build a Runtime from the environment settings in config.py. The MCP
+        server and ingest_daemon.py both go through here, so components are
+        wired and validated the same way in each.
+        """
+        import config
+        from sampling import build_policy
+
+        settings = dict(
+            csv_path=config.CSV_PATH,
+            manual_path=config.MANUAL_PATH,
+            broker_host=config.BROKER_HOST,
+            broker_port=config.BROKER_PORT,
+            speed_multiplier=config.SPEED_MULTIPLIER,
+            enable_simulator=config.ENABLE_SIMULATOR,
+            checkpoint_path=config.CHECKPOINT_PATH,
+            checkpoint_interval=config.CHECKPOINT_INTERVAL,
+            detector_mode=config.DETECTOR_MODE,
+            state_path=config.STATE_PATH,
+            state_stale_seconds=config.STATE_STALE_SECONDS,
+            manual_socket_path=config.MANUAL_SOCKET_PATH,
+            reading_storage=config.READING_STORAGE,
+            block_chunk_seconds=config.BLOCK_CHUNK_SECONDS,
+            block_max_open_seconds=config.BLOCK_MAX_OPEN_SECONDS,
+            persistence=build_policy(config.PERSISTENCE_POLICY, **config.PERSISTENCE_OPTIONS),
+            detection_mode=config.DETECTION_MODE,
+            baseline_options=config.BASELINE_OPTIONS,
+        )
+        settings.update(overrides)
+        return cls(**settings)
+
+    def start(self):
+        """Kick off component initialization in the background and return immediately."""
+        self._started_at = time.perf_counter()
+        self._submit("db", init_db)
+        self._submit("detector", self.detector.start, after=("db",))
+        if self.simulator is not None:
+            self._submit("simulator", self.simulator.start)
+        if self.detector_mode == "embedded":
+            self._submit("retriever", self._build_retriever)
+        self._submitted = True
+        self._maybe_report()
+
+    def shutdown(self, timeout: float = 5.0):
+        """
+        Stop background threads in reverse dependency order.
+
+        A component whose start() is still running (e.g. retrying the MQTT
+        broker) is told to stop first, which makes start() return early and
+        records it as 'stopped', and is then waited on so it cannot start
+        threads after shutdown returns. The retriever is not waited on; its
+        thread is a daemon and dies with the process.
+        """
+        self._stopping = True
+        for name, component in (("simulator", self.simulator), ("detector", self.detector)):
+            fut = self._futures.get(name)
+            if component is None or fut is None:
+                continue
+            if fut.done() and fut.exception() is not None:
+                continue
+            component.stop()
+            try:
+                fut.result(timeout=timeout)
+            except Exception:
+                pass
+
+    @property
+    def retriever(self):
+        """
+        The DeviceManualRetriever, waiting for it to finish loading if
+        necessary; in attached mode a ManualClient for the daemon's copy.
+        """
+        if self.detector_mode == "attached":
+            from manual_service import ManualClient
+            return ManualClient(self.manual_socket_path)
+        return self._futures["retriever"].result()
+
+    def startup_report(self) -> dict:
+        """Per-component initialization time, in seconds, and overall wall time."""
+        with self._lock:
+            components = dict(self._timings)
+        pending = [name for name in self._futures if name not in components]
+        for name in pending:
+            components[name] = {"status": "pending", "seconds": None}
+        finished = [c["finished_at"] for c in components.values() if "finished_at" in c]
+        return {
+            "components": {
+                name: {"status": c["status"], "seconds": c["seconds"]}
+                for name, c in components.items()
+            },
+            "total_seconds": round(max(finished), 3) if finished and not pending else None,
+        }
+
+    def _build_retriever(self):
+        # Imported here so that numpy, torch and sentence-transformers are
+        # only loaded on an init thread, never on the server's import path.
+        from rag import DeviceManualRetriever
+        return DeviceManualRetriever(self.manual_path)
+
+    def _submit(self, name, fn, after=()):
+        deps = [self._futures[d] for d in after]
+        fut = self._futures[name] = Future()
+
+        def run():
+            fut.set_running_or_notify_cancel()
+            try:
+                fut.set_result(self._run_step(name, fn, deps))
+            except BaseException as e:
+                fut.set_exception(e)
+
+        threading.Thread(target=run, name=f"aegisflow-init-{name}", daemon=True).start()
+
+    def _run_step(self, name, fn, deps):
+        t0 = None
+        status = "ok"
+        try:
+            for dep in deps:
+                dep.result()
+            t0 = time.perf_counter()
+            result = fn()
+            # start() returns early once shutdown() has called stop().
+            if self._stopping:
+                status = "stopped"
+            return result
+        except BaseException as e:
+            status = "failed" if t0 is not None else "skipped"
+            print(f"Startup: {name} {status}: {e}", file=sys.stderr)
+            raise
+        finally:
+            t1 = time.perf_counter()
+            t0 = t1 if t0 is None else t0
+            with self._lock:
+                self._timings[name] = {
+                    "status":      status,
+                    "seconds":     round(t1 - t0, 3),
+                    "finished_at": t1 - self._started_at,
+                }
+            self._maybe_report()
+
+    def _maybe_report(self):
+        with self._lock:
+            if (self._reported or not self._submitted
+                    or len(self._timings) < len(self._futures)):
+                return
+            self._reported = True
+        report = self.startup_report()
+        lines = [f"  {name:<10} {c['status']:<8} {c['seconds']:.3f}s"
+                 for name, c in report["components"].items()]
+        print(f"Startup complete in {report['total_seconds']:.3f}s\n" + "\n".join(lines),
+              file=sys.stderr)
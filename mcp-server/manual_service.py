@@ -0,0 +1,100 @@
+"""
+Manual retrieval served by the ingest daemon over a Unix socket, so attached
+MCP servers share one embedding model instead of each loading their own.
+
+Protocol: one request per connection. The client sends a JSON line
+{"query": str, "k": int}; the server answers with a JSON line
+{"sections": [str, ...]} or {"error": str}.
+"""
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import Future
+
+
+class ManualServer:
+    """
+    Builds a DeviceManualRetriever in the background and answers queries
+    for it on `path`. Requests that arrive while the model is still loading
+    wait for it.
+    """
+
+    def __init__(self, path: str, manual_path: str):
+        self.path = path
+        self.manual_path = manual_path
+        self._retriever = Future()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        threading.Thread(target=self._build, name="manual-retriever", daemon=True).start()
+
+        if os.path.exists(self.path):
+            # Left behind by a daemon that did not shut down cleanly; the
+            # shared-state lock guarantees no other daemon is serving it.
+            os.unlink(self.path)
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.wfile.write(json.dumps(service._answer(self.rfile.readline())).encode() + b"\n")
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _build(self):
+        # Imported here so the daemon starts ingesting before torch is loaded.
+        from rag import DeviceManualRetriever
+        self._retriever.set_running_or_notify_cancel()
+        try:
+            self._retriever.set_result(DeviceManualRetriever(self.manual_path))
+        except BaseException as e:
+            print(f"Manual retriever failed to load: {e}", file=sys.stderr)
+            self._retriever.set_exception(e)
+
+    def _answer(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+            retriever = self._retriever.result()
+            return {"sections": retriever.query(request["query"], k=int(request.get("k", 3)))}
+        except Exception as e:
+            return {"error": str(e)}
+
+
+class ManualClient:
+    """Drop-in for DeviceManualRetriever in attached servers: forwards query() to the daemon."""
+
+    def __init__(self, path: str, timeout: float = 120.0):
+        self.path = path
+        self.timeout = timeout
+
+    def query(self, text: str, k: int = 3) -> list:
+        request = json.dumps({"query": text, "k": k}).encode() + b"\n"
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall(request)
+                with sock.makefile("rb") as f:
+                    response = json.loads(f.readline())
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"Manual service at {self.path} unavailable ({e}); "
+                               f"is ingest_daemon.py running?") from e
+        if "error" in response:
+            raise RuntimeError(f"Manual service error: {response['error']}")
+        return response["sections"]
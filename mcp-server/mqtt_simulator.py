@@ -1,5 +1,6 @@
 import csv
 import json
+import sys
 import time
 import threading
 from datetime import datetime
@@ -26,6 +27,8 @@ class MQTTSimulator:
         self.client = mqtt.Client(client_id="aegisflow-simulator")
         self.running = False
         self._thread = None
+        self._stopping = threading.Event()
+        self._lifecycle_lock = threading.Lock()
 
     def start(self, retries: int = 10, delay: float = 3.0):
         """Connect to broker and start publishing in a background daemon thread."""
@@ -36,15 +39,28 @@ class MQTTSimulator:
             except ConnectionRefusedError:
                 if attempt == retries:
                     raise
-                print(f"⏳ MQTT broker not ready, retrying in {delay}s ({attempt}/{retries})...")
-                time.sleep(delay)
-        self.client.loop_start()
-        self.running = True
-        self._thread = threading.Thread(target=self._publish_loop, daemon=True)
-        self._thread.start()
+                print(f"⏳ MQTT broker not ready, retrying in {delay}s ({attempt}/{retries})...",
+                      file=sys.stderr)
+                if self._stopping.wait(delay):
+                    return
+        with self._lifecycle_lock:
+            if self._stopping.is_set():
+                self.client.disconnect()
+                return
+            self.client.loop_start()
+            self.running = True
+            self._thread = threading.Thread(target=self._publish_loop, daemon=True)
+            self._thread.start()
 
     def stop(self):
-        self.running = False
+        """Stop publishing. Safe to call while start() is still waiting for the broker."""
+        with self._lifecycle_lock:
+            self._stopping.set()
+            started, self.running = self.running, False
+        if not started:
+            return
+        if self._thread is not None:
+            self._thread.join(timeout=5)
         self.client.loop_stop()
         self.client.disconnect()
 
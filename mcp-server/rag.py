@@ -2,7 +2,6 @@ import re
 from typing import List
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 
 class DeviceManualRetriever:
@@ -16,6 +15,10 @@ class DeviceManualRetriever:
     MODEL_NAME = "all-MiniLM-L6-v2"
 
     def __init__(self, manual_path: str):
+        # torch + sentence-transformers take seconds to import; defer until
+        # a retriever is actually built.
+        from sentence_transformers import SentenceTransformer
+
         self.manual_path = manual_path
         self.model = SentenceTransformer(self.MODEL_NAME)
         self.chunks: List[str] = []
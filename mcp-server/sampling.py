@@ -0,0 +1,92 @@
+from collections import defaultdict, deque
+
+from timeutil import parse_ts_ms
+
+
+class AdaptivePersistence:
+    """
+    Decides which readings the detector writes to sensor_readings.
+
+    In steady state a reading is persisted only when some metric has moved
+    more than `deadband_sigma` rolling standard deviations (or the absolute
+    `min_tolerance`) away from the last persisted value, or when
+    `max_interval` seconds have passed since the last write. The skipped
+    readings are held in a per-device pre-trigger ring buffer; when the
+    detector signals an anomalous state the buffer is flushed and the device is captured
+    at full rate for the next `post_trigger` readings.
+    """
+
+    def __init__(self, deadband_sigma: float = 4.0, max_interval: float = 120.0,
+                 pre_trigger: int = 24, post_trigger: int = 60, min_tolerance: float = 1e-6):
+        self.deadband_sigma = deadband_sigma
+        self.max_interval_ms = int(max_interval * 1000)
+        self.post_trigger = post_trigger
+        self.min_tolerance = min_tolerance
+
+        self._last_stored = {}      # device_id -> (ts_ms, reading)
+        self._pending = defaultdict(lambda: deque(maxlen=pre_trigger))
+        self._full_rate_left = defaultdict(int)
+
+    def observe(self, reading: dict, stds: dict, triggered: bool) -> list:
+        """
+        Feed one reading. `stds` maps metric to the rolling std it was scored
+        against; `triggered` is True when the device has entered (or re-entered)
+        an anomalous state and should be captured at full rate.
+        Returns the readings to persist now, oldest first.
+        """
+        device_id = reading["device_id"]
+        ts = parse_ts_ms(reading["timestamp"])
+        pending = self._pending[device_id]
+
+        if triggered:
+            self._full_rate_left[device_id] = self.post_trigger
+            out = list(pending) + [reading]
+            pending.clear()
+        elif self._full_rate_left[device_id] > 0:
+            self._full_rate_left[device_id] -= 1
+            out = [reading]
+        elif self._should_store(device_id, ts, reading, stds):
+            out = [reading]
+        else:
+            pending.append(reading)
+            return []
+
+        self._last_stored[device_id] = (ts, reading)
+        return out
+
+    def _should_store(self, device_id, ts, reading, stds):
+        last = self._last_stored.get(device_id)
+        if last is None:
+            return True
+        last_ts, last_reading = last
+        if ts - last_ts >= self.max_interval_ms or ts < last_ts:
+            return True
+        for metric, std in stds.items():
+            value, previous = reading.get(metric), last_reading.get(metric)
+            if value is None or previous is None:
+                continue
+            if abs(value - previous) > max(self.deadband_sigma * std, self.min_tolerance):
+                return True
+        return False
+
+
+class EveryNthPersistence:
+    """The original fixed decimation: persist every n-th reading per device."""
+
+    def __init__(self, n: int = 5):
+        self.n = n
+        self._counter = defaultdict(int)
+
+    def observe(self, reading: dict, stds: dict, triggered: bool) -> list:
+        device_id = reading["device_id"]
+        self._counter[device_id] += 1
+        return [reading] if self._counter[device_id] % self.n == 0 else []
+
+
+def build_policy(name: str = "adaptive", **options):
+    """Construct a persistence policy by name: 'adaptive' or 'every5'."""
+    if name == "adaptive":
+        return AdaptivePersistence(**options)
+    if name == "every5":
+        return EveryNthPersistence(5)
+    raise ValueError(f"Unknown persistence policy {name!r}; expected 'adaptive' or 'every5'")
@@ -1,43 +1,26 @@
-import json
-import os
+import fnmatch
+import signal
+import sys
 from datetime import datetime
 
 from mcp.server.fastmcp import FastMCP
 
-from db import init_db, get_connection
-from anomaly_detector import AnomalyDetector
-from mqtt_simulator import MQTTSimulator
-from rag import DeviceManualRetriever
+from db import get_connection
+from lifecycle import Runtime
 
-_HERE = os.path.dirname(os.path.abspath(__file__))
-_DATA_DIR = os.path.join(_HERE, "data")
-_CSV_PATH = os.path.join(_DATA_DIR, "sensor_data.csv")
-_MANUAL_PATH = os.path.join(_DATA_DIR, "device_manual.md")
-
-init_db()
-retriever = DeviceManualRetriever(_MANUAL_PATH)
-
-_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
-_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", "1883"))
-_SPEED = float(os.getenv("SPEED_MULTIPLIER", "100"))
-
-simulator = MQTTSimulator(_CSV_PATH, broker_host=_BROKER_HOST,
-                          broker_port=_BROKER_PORT, speed_multiplier=_SPEED)
-detector = AnomalyDetector(broker_host=_BROKER_HOST, broker_port=_BROKER_PORT)
+runtime = Runtime.from_config()
+detector = runtime.detector
 
 anomaly_queue: list[dict] = []
 
 
 def on_anomaly(info: dict):
     anomaly_queue.append(info)
-    print(f"ANOMALY DETECTED: {info['device_id']} — {info['severity'].upper()}")
+    print(f"ANOMALY DETECTED: {info['device_id']} — {info['severity'].upper()}", file=sys.stderr)
 
 
 detector.on_anomaly_detected = on_anomaly
 
-simulator.start()
-detector.start()
-
 mcp = FastMCP("aegisflow")
 
 
@@ -54,6 +37,91 @@ def get_sensor_stream(device_id: str = "all", limit: int = 20) -> list[dict]:
     return detector.get_recent_readings(device_id, limit)
 
 
+@mcp.tool()
+def get_sensor_series(
+    device_id: str,
+    start: str = "",
+    end: str = "",
+    hours: float = 6.0,
+    max_points: int = 300,
+    token_budget: int = 0,
+    method: str = "lttb",
+) -> dict:
+    """Get a long stretch of a device's sensor history, downsampled server-side.
+
+    Use this instead of get_sensor_stream when you need hours of context: the
+    series is reduced to at most max_points points with a shape-preserving
+    algorithm, and readings around detected anomalies are kept within that limit.
+
+    The result is columnar: 't0' is the first timestamp, 't_offset_s' holds each
+    point's offset from t0 in seconds, and each metric is an array aligned with it.
+    'anomalies' lists the most recent anomalies in range (at most a tenth of
+    max_points); 'anomalies_total' counts all of them.
+
+    Args:
+        device_id:    Device identifier, e.g. 'line-1/compressor-01'
+        start:        ISO timestamp to start from (default: `hours` before end)
+        end:          ISO timestamp to stop at (default: the device's latest reading)
+        hours:        Window length when start is omitted (default 6)
+        max_points:   Upper bound on returned points (default 300)
+        token_budget: Optional approximate token budget; lowers max_points to fit
+        method:       'lttb' (shape-preserving, default) or 'minmax' (keeps every bucket's extremes)
+    """
+    from timeutil import format_ts_ms, parse_ts_ms
+    from downsample import TOKENS_PER_POINT, reduce_series
+
+    if token_budget > 0:
+        max_points = min(max_points, max(token_budget // TOKENS_PER_POINT, 3))
+    if not start:
+        if end:
+            end_ms = parse_ts_ms(end)
+        else:
+            latest = detector.latest_readings.get(device_id)
+            end_ms = parse_ts_ms(latest["timestamp"]) if latest else int(datetime.now().timestamp() * 1000)
+        start = format_ts_ms(end_ms - int(hours * 3600 * 1000))
+
+    timestamps, columns = detector.get_series(device_id, start, end or None)
+
+    anomalies = []
+    if len(timestamps):
+        first, last = int(timestamps[0]), int(timestamps[-1])
+        conn = get_connection()
+        cursor = conn.cursor()
+        # detected_at is an ISO string; the bounds are padded by a second so
+        # fractional timestamps compare correctly, then filtered exactly below.
+        cursor.execute("""
+            SELECT detected_at, severity FROM anomalies
+            WHERE device_id = ? AND detected_at BETWEEN ? AND ?
+            ORDER BY detected_at
+        """, (device_id, format_ts_ms(first - 1000), format_ts_ms(last + 1000)))
+        for detected_at, severity in cursor.fetchall():
+            ts = parse_ts_ms(detected_at)
+            if first <= ts <= last:
+                anomalies.append({"detected_at": detected_at, "severity": severity, "ts": ts})
+        conn.close()
+
+    selected = reduce_series(timestamps, columns, max_points, method=method,
+                             keep_timestamps=[a["ts"] for a in anomalies])
+    t = timestamps[selected]
+    result = {
+        "device_id":       device_id,
+        "method":          method,
+        "source_points":   int(len(timestamps)),
+        "returned_points": int(len(selected)),
+        "t0":              format_ts_ms(int(t[0])) if len(t) else None,
+        "t_offset_s":      ((t - t[0]) // 1000).tolist() if len(t) else [],
+    }
+    for metric, values in columns.items():
+        result[metric] = [None if v != v else round(v, 3) for v in values[selected].tolist()]
+    # The anomaly list is part of the response too; keep it proportionate.
+    listed = anomalies[-max(max_points // 10, 1):]
+    result["anomalies_total"] = len(anomalies)
+    result["anomalies"] = [
+        {"detected_at": a["detected_at"], "severity": a["severity"]} for a in listed
+    ]
+    return result
+
+
 @mcp.tool()
 def get_device_status(device_id: str) -> dict:
     """Get the current status of a specific device.
@@ -74,6 +142,70 @@ def get_device_status(device_id: str) -> dict:
     }
 
 
+def _resolve_devices(devices: str | list[str]) -> list[str]:
+    """
+    Expand device ids and globs like 'line-2/*' against the devices currently
+    reporting plus every device with stored history, so globs still match
+    after a restart or while the ingest daemon is down.
+    """
+    if isinstance(devices, str):
+        devices = [devices]
+    known = None
+    resolved = []
+    for pattern in devices:
+        if any(c in pattern for c in "*?["):
+            if known is None:
+                known = sorted(set(detector.latest_readings) | set(detector.active_anomalies)
+                               | set(detector.get_stored_devices()))
+            matches = fnmatch.filter(known, pattern)
+        else:
+            matches = [pattern]
+        resolved.extend(m for m in matches if m not in resolved)
+    return resolved
+
+
+@mcp.tool()
+def get_devices_status(devices: str | list[str], history_limit: int = 10) -> list[dict]:
+    """Get the current status and recent history of several devices in one call.
+
+    Use this instead of repeated get_device_status calls when checking a whole
+    production line or a group of related equipment.
+
+    Args:
+        devices:       A device id or glob, or a list of them, e.g. 'line-2/*' or
+                       ['line-1/compressor-01', 'line-3/pump-*']
+        history_limit: Recent stored readings to include per device (default 10, 0 for none)
+    """
+    device_ids = _resolve_devices(devices)
+    latest_readings = detector.latest_readings
+    active_anomalies = detector.active_anomalies
+    history = detector.get_recent_readings_bulk(device_ids, history_limit) if history_limit > 0 else {}
+    results = []
+    for device_id in device_ids:
+        active_anomaly = active_anomalies.get(device_id)
+        results.append({
+            "device_id":       device_id,
+            "status":          "anomaly_active" if active_anomaly else "normal",
+            "latest_readings": latest_readings.get(device_id),
+            "active_anomaly":  active_anomaly,
+            "recent_readings": history.get(device_id, []),
+        })
+    return results
+
+
+@mcp.tool()
+def get_sensor_streams(devices: str | list[str], limit: int = 20) -> dict:
+    """Get recent sensor history for several devices in one call.
+
+    Returns a mapping of device_id to its most recent stored readings (newest first).
+
+    Args:
+        devices: A device id or glob, or a list of them, e.g. 'line-2/*'
+        limit:   Maximum readings per device (default 20)
+    """
+    return detector.get_recent_readings_bulk(_resolve_devices(devices), limit)
+
+
 @mcp.tool()
 def get_active_anomalies() -> list[dict]:
     """Get all currently active anomaly alerts across the entire plant.
@@ -131,7 +263,7 @@ def query_device_manual(query: str) -> str:
         query: Natural language description of what you need, e.g.
                'thermal runaway compressor emergency procedure'
     """
-    results = retriever.query(query, k=3)
+    results = runtime.retriever.query(query, k=3)
     return "\n\n---\n\n".join(results)
 
 
@@ -318,5 +450,14 @@ def log_incident_report(
     }
 
 
+def _handle_sigterm(signum, frame):
+    sys.exit(0)
+
+
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    runtime.start()
+    try:
+        mcp.run(transport="stdio")
+    finally:
+        runtime.shutdown()
@@ -0,0 +1,290 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from history import StoredReadingsMixin
+
+# Segment layout (little-endian), guarded by a seqlock:
+#   0   4s  magic "AGSS"
+#   4   u32 layout version
+#   8   u64 sequence — odd while the writer is mid-update, even when stable
+#   16  u32 payload capacity in bytes
+#   20  u32 payload length
+#   24  f64 published_at (unix time) — also refreshed outside the seqlock
+#           as a heartbeat while the state is unchanged
+#   32  u32 writer pid
+#   64  payload: UTF-8 JSON of AnomalyDetector.live_state()
+MAGIC = b"AGSS"
+LAYOUT_VERSION = 1
+HEADER_SIZE = 64
+
+_HEADER = struct.Struct("<4sIQIIdI")
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 8
+_BODY = struct.Struct("<IIdI")   # capacity, length, published_at, pid
+_BODY_OFFSET = 16
+_STAMP = struct.Struct("<d")
+_STAMP_OFFSET = 24
+
+
+class SharedStateWriter:
+    """
+    Single writer for the live-state segment, backed by a memory-mapped file
+    (under /dev/shm by default, so it never touches disk).
+
+    The file is created or reused in place rather than replaced, so readers
+    that are already attached keep working across daemon restarts. The
+    writer holds an exclusive flock on it for its lifetime; a second writer
+    on the same path raises RuntimeError instead of interleaving sequence
+    numbers with the first.
+    """
+
+    def __init__(self, path: str, capacity: int = 4 * 1024 * 1024):
+        self.path = path
+        self.capacity = capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                header = os.pread(fd, _HEADER.size, 0)
+                pid = _HEADER.unpack(header)[6] if len(header) == _HEADER.size else "?"
+                raise RuntimeError(f"Shared state at {path} is already being written "
+                                   f"by another process (pid {pid})") from None
+            if os.fstat(fd).st_size < HEADER_SIZE + capacity:
+                os.ftruncate(fd, HEADER_SIZE + capacity)
+            self._mm = mmap.mmap(fd, HEADER_SIZE + capacity)
+        except BaseException:
+            os.close(fd)
+            raise
+        # Kept open: closing it would release the lock.
+        self._fd = fd
+
+        magic = self._mm[:4]
+        (seq,) = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)
+        # Continue the previous writer's sequence so readers notice the change;
+        # round up if it died mid-update.
+        self._seq = seq + (seq & 1) if magic == MAGIC else 0
+        _HEADER.pack_into(self._mm, 0, MAGIC, LAYOUT_VERSION, self._seq,
+                          capacity, 0, 0.0, os.getpid())
+
+    def publish(self, state: dict) -> bool:
+        """Write a new state. Returns False if it does not fit in the segment."""
+        payload = json.dumps(state, separators=(",", ":")).encode()
+        if len(payload) > self.capacity:
+            print(f"Shared state ({len(payload)} bytes) exceeds segment capacity "
+                  f"({self.capacity} bytes); not published", file=sys.stderr)
+            return False
+
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq + 1)
+        self._mm[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+        _BODY.pack_into(self._mm, _BODY_OFFSET, self.capacity, len(payload),
+                        time.time(), os.getpid())
+        self._seq += 2
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+        return True
+
+    def heartbeat(self):
+        """Mark the current state as still live without rewriting it."""
+        _STAMP.pack_into(self._mm, _STAMP_OFFSET, time.time())
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+
+class SharedStateReader:
+    """
+    Read-only view of the segment. Each read() is a seqlock read: copy the
+    payload, then retry if the sequence changed underneath us. Decoded state
+    is cached per sequence number, so polling an idle segment is just one
+    8-byte read.
+    """
+
+    def __init__(self, path: str, retries: int = 100):
+        self.path = path
+        self.retries = retries
+        self._mm = None
+        self._seq = None
+        self._state = {}
+
+    def read(self) -> dict:
+        """Latest consistent state, or the last one seen if the writer is mid-update."""
+        if self._mm is None and not self._attach():
+            return self._state
+
+        for _ in range(self.retries):
+            (seq,) = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            if seq == self._seq:
+                return self._state
+
+            capacity, length, _, _ = _BODY.unpack_from(self._mm, _BODY_OFFSET)
+            if HEADER_SIZE + capacity > len(self._mm):
+                # The writer grew the segment; remap and try again.
+                self.close()
+                if not self._attach():
+                    return self._state
+                continue
+            payload = self._mm[HEADER_SIZE:HEADER_SIZE + length]
+
+            (seq_after,) = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)
+            if seq_after != seq:
+                continue
+            self._state = json.loads(payload) if length else {}
+            self._seq = seq
+            return self._state
+        return self._state
+
+    @property
+    def published_at(self):
+        """Unix time of the writer's last publish or heartbeat, or None if not attached."""
+        if self._mm is None and not self._attach():
+            return None
+        (published_at,) = _STAMP.unpack_from(self._mm, _STAMP_OFFSET)
+        return published_at or None
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _attach(self):
+        try:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        if len(mm) < HEADER_SIZE or mm[:4] != MAGIC:
+            mm.close()
+            return False
+        self._mm = mm
+        return True
+
+
+class StatePublisher:
+    """
+    Runs inside the ingest daemon: publishes AnomalyDetector.live_state()
+    whenever it changes, heartbeats the segment while it does not, and
+    periodically picks up anomalies that attached MCP servers resolved
+    through the database.
+    """
+
+    def __init__(self, detector, writer: SharedStateWriter,
+                 interval: float = 0.25, reconcile_interval: float = 2.0):
+        self.detector = detector
+        self.writer = writer
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.writer.publish(self.detector.live_state())
+
+    def _loop(self):
+        published = None
+        next_reconcile = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= next_reconcile:
+                try:
+                    self.detector.reconcile()
+                except Exception as e:
+                    print(f"Anomaly reconcile failed: {e}", file=sys.stderr)
+                next_reconcile = now + self.reconcile_interval
+            if self.detector.version != published:
+                state = self.detector.live_state()
+                if self.writer.publish(state):
+                    published = state["version"]
+            else:
+                self.writer.heartbeat()
+            if self._stop_event.wait(self.interval):
+                return
+
+
+class SharedDetectorView(StoredReadingsMixin):
+    """
+    Stand-in for AnomalyDetector in MCP server processes that attach to the
+    ingest daemon instead of running their own MQTT client and detector.
+    Exposes the same attributes and methods the tools use.
+
+    If the daemon has not published or heartbeated for `stale_after`
+    seconds it is presumed dead, and the live views (latest readings,
+    active anomalies, rolling stats) are reported empty rather than served
+    as current. Stored history is unaffected.
+    """
+
+    def __init__(self, state_path: str, block_store=None, stale_after: float = 5.0):
+        self.reader = SharedStateReader(state_path)
+        self.block_store = block_store
+        self.stale_after = stale_after
+        self._warned_stale = False
+        self.on_anomaly_detected = None
+        # Anomalies this process resolved, hidden until the daemon reconciles
+        # them out of the published state: device_id -> detected_at.
+        self._cleared = {}
+
+    def start(self):
+        if not self.reader.read():
+            print(f"Shared state at {self.reader.path} not available yet; "
+                  f"is ingest_daemon.py running?", file=sys.stderr)
+
+    def stop(self):
+        self.reader.close()
+
+    @property
+    def stale(self) -> bool:
+        """True when the daemon has not published within `stale_after` seconds."""
+        published_at = self.reader.published_at
+        return published_at is None or time.time() - published_at > self.stale_after
+
+    def _live_state(self) -> dict:
+        state = self.reader.read()
+        if not self.stale:
+            self._warned_stale = False
+            return state
+        if not self._warned_stale:
+            self._warned_stale = True
+            print(f"Shared state at {self.reader.path} is stale (no update for over "
+                  f"{self.stale_after:g}s); is ingest_daemon.py running?", file=sys.stderr)
+        return {}
+
+    @property
+    def latest_readings(self) -> dict:
+        return self._live_state().get("latest_readings", {})
+
+    @property
+    def active_anomalies(self) -> dict:
+        anomalies = self._live_state().get("active_anomalies", {})
+        for device_id, detected_at in list(self._cleared.items()):
+            current = anomalies.get(device_id)
+            if current is None or current["detected_at"] != detected_at:
+                del self._cleared[device_id]
+        return {
+            device_id: info for device_id, info in anomalies.items()
+            if device_id not in self._cleared
+        }
+
+    def rolling_stats(self) -> dict:
+        return self._live_state().get("rolling_stats", {})
+
+    def clear_anomaly(self, device_id):
+        """Hide the anomaly locally; the daemon drops it once it sees the DB update."""
+        info = self.reader.read().get("active_anomalies", {}).get(device_id)
+        if info is not None:
+            self._cleared[device_id] = info["detected_at"]
@@ -0,0 +1,18 @@
+"""Conversions between the simulator's ISO timestamps and epoch milliseconds."""
+from datetime import datetime, timezone
+
+
+def parse_ts_ms(ts: str) -> int:
+    """ISO-8601 timestamp (with or without trailing Z) to epoch milliseconds, UTC."""
+    dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(round(dt.timestamp() * 1000))
+
+
+def format_ts_ms(ms: int) -> str:
+    """Epoch milliseconds back to the 'YYYY-MM-DDTHH:MM:SSZ' form the simulator publishes."""
+    dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    if ms % 1000:
+        return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")